@@ -22,8 +22,11 @@ import logging
 import os
 import re
 import signal
+import subprocess
 import sys
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 from time import sleep
 
 #nova libs
@@ -31,6 +34,10 @@ from novaclient import base
 from novaclient.exceptions import NotFound as NovaNotFound
 from novaclient.v1_1 import client
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from phaseProfiler import PhaseProfiler
+
 
 logging.basicConfig(format='%(levelname)s\t%(name)s\t%(message)s')
 
@@ -45,7 +52,10 @@ class NovaServiceTest(object):
 
     def __init__(self, username=None, password=None, tenant=None,
                  auth_url=None, region=None, keypair=None, auth_ver='2.0',
-                 count=1, instance_name='NovaServiceTest', timeout=20):
+                 count=1, instance_name='NovaServiceTest', timeout=20,
+                 floating_ips=False, floating_pool=None,
+                 floating_concurrency=4, floating_wait=5,
+                 reachable_timeout=2):
 
         self.username = username
         self.password = password
@@ -57,9 +67,23 @@ class NovaServiceTest(object):
         self.count = count
         self.test_name = instance_name
         self.timeout = timeout
+        self.floating_ips = floating_ips
+        self.floating_pool = floating_pool
+        self.floating_concurrency = floating_concurrency
+        self.floating_wait = floating_wait
+        self.reachable_timeout = reachable_timeout
+        if floating_wait + reachable_timeout >= timeout:
+            logger.warning("Floating address wait and reachability timeout "
+                           "({0} + {1} minutes) leave no time to build within "
+                           "the {2} minute timeout".format(floating_wait,
+                                                           reachable_timeout,
+                                                           timeout))
 
         self.nova = None
         self.server = {}
+        self._local = threading.local()
+        self.pool = None
+        self.stopping = threading.Event()
 
         self.path = os.path.dirname(__file__)
         if not self.path:
@@ -71,16 +95,30 @@ class NovaServiceTest(object):
         if self.nova and not force:
             return
 
-        self.nova = client.Client(username=self.username,
-                                  api_key=self.password,
-                                  project_id=self.tenant,
-                                  auth_url=self.auth_url,
-                                  region_name=self.region,
-                                  service_type="compute")
+        self.nova = self.new_client()
+
+
+    def new_client(self):
+        return client.Client(username=self.username,
+                             api_key=self.password,
+                             project_id=self.tenant,
+                             auth_url=self.auth_url,
+                             region_name=self.region,
+                             service_type="compute")
 
 
-    def cleanup(self):
-        '''Remove any instances with a matching name then exit.'''
+    def thread_client(self):
+        '''Return a nova client private to the calling thread.'''
+        if getattr(self._local, 'nova', None) is None:
+            self._local.nova = self.new_client()
+        return self._local.nova
+
+
+    def cleanup(self, die=True):
+        '''
+        Remove any instances with a matching name and release their floating
+        IPs, then exit unless die is False.
+        '''
         previous = re.compile('^' + self.test_name)
         exit = False
         for _server in self.nova.servers.list():
@@ -89,7 +127,13 @@ class NovaServiceTest(object):
                 self.server[_server.id] = {}
                 exit = True
         if exit:
+            for fip in self.nova.floating_ips.list():
+                if fip.instance_id in self.server:
+                    self.server[fip.instance_id]['floating_ip'] = fip
+        if exit and die:
             self.dieGracefully()
+        elif exit:
+            self.deleteAll()
 
 
     def set_flavor(self, flavor):
@@ -121,40 +165,150 @@ class NovaServiceTest(object):
             logger.info("Creating server {0}".format(newid))
             sleep(1) #prevent being rate-limited
 
-        create_list = self.server.keys()
+        # Poll every server with a single listing call; it also carries the
+        # addresses, so we can see when each one gets an IP.
+        create_list = list(self.server.keys())
+        attaching = []
+        if self.floating_ips:
+            self.pool = ThreadPool(self.floating_concurrency)
         backoff = 1
         while create_list:
-            for i in create_list:
-                try:
-                    _server = self.nova.servers.get(i)
-                except Exception as e:
-                    logger.exception("Could not get server info.")
-                    self.dieGracefully()
+            try:
+                servers = dict((s.id, s) for s in self.nova.servers.list())
+            except Exception as e:
+                logger.exception("Could not get server info.")
+                self.dieGracefully()
+            now = datetime.now()
+
+            for i in list(create_list):
+                if i not in servers:
+                    logger.warn("Server {0} missing from server list".format(i))
+                    continue
+                _server = servers[i]
+                self.network_status(i, _server, now)
 
                 if _server.status.startswith("BUILD"):
                     pass
                 elif _server.status == "ACTIVE":
-                    create_list.remove(i)
-                    self.server[i]['time']['create_end'] = datetime.now()
-                    self.server[i]['time']['create_total'] = \
-                            self.server[i]['time']['create_end'] - \
-                            self.server[i]['time']['create_start']
-                    self.server[i]['active'] = True
-                    logger.info("Server {0} created".format(i))
-                    self.server[i]['ip'] = \
-                            _server.addresses['private'][1]['addr']
-                    #_server.addresses['public'][0]['addr']
-                    #eventually hpcloud will use a version of openstack that
-                    #does this right
+                    if 'create_end' not in self.server[i]['time']:
+                        self.server[i]['time']['create_end'] = now
+                        self.server[i]['time']['create_total'] = \
+                                self.server[i]['time']['create_end'] - \
+                                self.server[i]['time']['create_start']
+                        self.server[i]['active'] = True
+                        logger.info("Server {0} created".format(i))
+                    if self.address_ready(i, now):
+                        create_list.remove(i)
+                        if self.pool:
+                            attaching.append(self.pool.apply_async(
+                                    self.attach_floating_ip, (i,)))
                 elif _server.status.startswith("ERROR"):
                     logger.error("Server {0} status: {1}".format(i, _server.status))
                     self.dieGracefully()
                 else:
                     logger.warn("Server {0} status: {1}".format(i, _server.status))
+
+            if create_list:
                 # making nova calls too quickly will get us rate-limited
-                sleep(1 * backoff)
+                sleep(min(backoff, 5))
                 backoff += 1
 
+        if self.pool:
+            self.pool.close()
+            for result in attaching:
+                try:
+                    result.get()
+                except Exception as e:
+                    logger.exception("Could not attach floating IP.")
+                    self.dieGracefully()
+            self.pool.join()
+            self.pool = None
+
+
+    def network_status(self, i, _server, now):
+        '''
+        Record when server i first reports a fixed and a floating IPv4
+        address, and use the floating one, if any, as its ip.
+        '''
+        fixed = []
+        floating = []
+        for network, addresses in _server.addresses.items():
+            for n, address in enumerate(addresses):
+                if address.get('version', 4) != 4:
+                    continue
+                # Without the OS-EXT-IPS extension the fixed address comes
+                # first, followed by any floating ones.
+                kind = address.get('OS-EXT-IPS:type')
+                if kind == 'floating' or (kind is None and n > 0):
+                    floating.append(address['addr'])
+                else:
+                    fixed.append(address['addr'])
+
+        t = self.server[i]['time']
+        if fixed and 'ip_seen' not in t:
+            t['ip_seen'] = now
+            t['ip_total'] = now - t['create_start']
+            self.server[i]['fixed_ip'] = fixed[0]
+            logger.info("Server {0} has address {1}".format(i, fixed[0]))
+        if floating and 'floating_ip_seen' not in t:
+            t['floating_ip_seen'] = now
+            logger.info("Server {0} has address {1}".format(i, floating[0]))
+        if floating or fixed:
+            self.server[i]['ip'] = (floating or fixed)[0]
+
+
+    def address_ready(self, i, now):
+        '''
+        Return whether active server i has the address the tests should
+        use.  Unless we attach floating IPs ourselves, wait up to
+        self.floating_wait minutes for one to be assigned, then fall back to
+        the fixed address.
+        '''
+        if 'ip' not in self.server[i]:
+            return False
+        t = self.server[i]['time']
+        if self.floating_ips or 'floating_ip_seen' in t:
+            return True
+        if now - t['create_end'] < timedelta(minutes=self.floating_wait):
+            return False
+        if self.floating_wait:
+            logger.warn("Server {0} has no floating address after {1} "
+                        "minutes, using {2}".format(i, self.floating_wait,
+                                                    self.server[i]['ip']))
+        return True
+
+
+    def attach_floating_ip(self, i):
+        '''
+        Allocate a floating IP, associate it with server i and wait until
+        it answers a ping, timing each step.
+        '''
+        nova = self.thread_client()
+        t = self.server[i]['time']
+
+        t['fip_start'] = datetime.now()
+        fip = nova.floating_ips.create(pool=self.floating_pool)
+        self.server[i]['floating_ip'] = fip
+        t['fip_allocated'] = datetime.now()
+        logger.info("Allocated {0} for server {1}".format(fip.ip, i))
+
+        nova.servers.add_floating_ip(i, fip.ip)
+        t['fip_associated'] = datetime.now()
+        self.server[i]['ip'] = fip.ip
+
+        deadline = datetime.now() + timedelta(minutes=self.reachable_timeout)
+        with open(os.devnull, 'w') as devnull:
+            while datetime.now() < deadline and not self.stopping.is_set():
+                if subprocess.call(['ping', '-q', '-n', '-c', '1', '-W', '1',
+                                    fip.ip], stdout=devnull,
+                                   stderr=devnull) == 0:
+                    t['fip_reachable'] = datetime.now()
+                    logger.info("Server {0} reachable at {1}".format(i,
+                                                                   fip.ip))
+                    return
+                sleep(1)
+        logger.warn("Server {0} never answered on {1}".format(i, fip.ip))
+
 
     def other_tests(self):
         """
@@ -231,6 +385,7 @@ class NovaServiceTest(object):
                 'create': '{0}/results/creation.csv'.format(self.path),
                 'delete': '{0}/results/deletion.csv'.format(self.path),
                 'life':  '{0}/results/lifespan.csv'.format(self.path),
+                'network': '{0}/results/network.csv'.format(self.path),
                 }
         if not os.path.isdir('{0}/results'.format(self.path)):
             os.makedirs('{0}/results'.format(self.path))
@@ -288,6 +443,32 @@ class NovaServiceTest(object):
             output.writerow([self.server[i]['time']['delete_total'].seconds /
                              60.0 for i in self.server.keys()])
 
+        def seconds(t, start, end):
+            if start in t and end in t:
+                return (t[end] - t[start]).total_seconds()
+            return None
+
+        def active_to_ip(t):
+            # An address often appears while the server is still in BUILD;
+            # report that as no wait rather than a negative one.
+            elapsed = seconds(t, 'create_end', 'ip_seen')
+            if elapsed is None:
+                return None
+            return max(elapsed, 0)
+
+        with open(csvfiles['network'], 'w+b') as f:
+            output = csv.writer(f)
+            output.writerow(['Server', 'Time to IP', 'Active to IP',
+                             'Floating IP allocate', 'Floating IP associate',
+                             'Floating IP reachable'])
+            for n, i in enumerate(self.server.keys()):
+                t = self.server[i]['time']
+                output.writerow([n, seconds(t, 'create_start', 'ip_seen'),
+                                 active_to_ip(t),
+                                 seconds(t, 'fip_start', 'fip_allocated'),
+                                 seconds(t, 'fip_allocated', 'fip_associated'),
+                                 seconds(t, 'fip_associated', 'fip_reachable')])
+
 
     def dieGracefully(self, code=-1, msg=None):
         self.deleteAll()
@@ -299,6 +480,14 @@ class NovaServiceTest(object):
     def deleteAll(self):
         exc_list = []
 
+        # Let any floating IP attach in progress finish, so that its address
+        # is recorded before we release it below.
+        if self.pool:
+            self.stopping.set()
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
         for i in self.server.keys():
             try:
                 logger.info('Deleting server: {0}'.format(i))
@@ -307,6 +496,17 @@ class NovaServiceTest(object):
                 logger.exception('Encountered an Exception: {0}'.format(e))
                 exc_list.append(e)
 
+        for i in self.server.keys():
+            fip = self.server[i].pop('floating_ip', None)
+            if fip is None:
+                continue
+            try:
+                logger.info('Releasing floating IP: {0}'.format(fip.ip))
+                self.nova.floating_ips.delete(fip)
+            except Exception as e:
+                logger.exception('Encountered an Exception: {0}'.format(e))
+                exc_list.append(e)
+
         if exc_list:
             logger.warn('Raising encountered exceptions.')
             for e in exc_list:
@@ -336,6 +536,28 @@ if __name__ == "__main__":
     op.add_option('-t', '--timeout', dest='timeout', type=int,
                   default=20, help='Timeout (in minutes) for creating or '
                   'deleting instances')
+    op.add_option('-f', '--floating-ips', action='store_true',
+                  dest='floating_ips', default=False, help='Allocate and '
+                  'associate a floating IP for each instance.')
+    op.add_option('--floating-pool', dest='floating_pool', type=str,
+                  default=None, help='Pool to allocate floating IPs from.')
+    op.add_option('--floating-concurrency', dest='floating_concurrency',
+                  type=int, default=4, help='Number of floating IPs to '
+                  'allocate and associate at once.')
+    op.add_option('--floating-wait', dest='floating_wait', type=int,
+                  default=5, help='Minutes to wait for an automatically '
+                  'assigned floating IP before using the fixed IP (0 to not '
+                  'wait).')
+    op.add_option('--reachable-timeout', dest='reachable_timeout', type=int,
+                  default=2, help='Minutes to wait for an attached floating '
+                  'IP to answer a ping.')
+    op.add_option('-p', '--profile', action='store_true', dest='profile',
+                  default=False, help='Profile each phase, writing dumps '
+                  'to results/profile.')
+    op.add_option('--profile-timings', action='store_true',
+                  dest='profile_timings', default=False, help='Record only '
+                  'the per-phase CPU/wait split, without the overhead of '
+                  'cProfile and tracemalloc.')
     options, args = op.parse_args()
 
     if options.log_level.upper() in ['DEBUG', 'INFO', 'WARNING', 'ERROR',
@@ -346,7 +568,12 @@ if __name__ == "__main__":
                                 tenant=tenant, auth_url=auth_url,
                                 region=region, keypair=keypair,
                                 instance_name=name, count=count,
-                                timeout=options.timeout)
+                                timeout=options.timeout,
+                                floating_ips=options.floating_ips,
+                                floating_pool=options.floating_pool,
+                                floating_concurrency=options.floating_concurrency,
+                                floating_wait=options.floating_wait,
+                                reachable_timeout=options.reachable_timeout)
 
     def signal_handler(signal, frame):
         '''Trap SIGINT'''
@@ -359,6 +586,11 @@ if __name__ == "__main__":
         nova_test.dieGracefully()
     signal.signal(signal.SIGALRM, alarm_handler)
 
+    profiler = PhaseProfiler('{0}/results/profile'.format(nova_test.path),
+                             enabled=(options.profile or
+                                      options.profile_timings),
+                             instrument=options.profile)
+
     nova_test.connect()
     nova_test.cleanup()
 
@@ -367,14 +599,20 @@ if __name__ == "__main__":
     nova_test.set_image('Ubuntu Precise 12.04 LTS Server 64-bit 20121026 (b)')
 
     signal.alarm(nova_test.timeout*60)
-    nova_test.create()
+    with profiler.phase('create'):
+        nova_test.create()
     signal.alarm(0)
 
-    nova_test.other_tests()
+    with profiler.phase('other_tests'):
+        nova_test.other_tests()
 
     signal.alarm(nova_test.timeout*60)
-    nova_test.delete()
+    with profiler.phase('delete'):
+        nova_test.delete()
     signal.alarm(0)
 
-    nova_test.results()
+    with profiler.phase('results'):
+        nova_test.results()
+
+    profiler.summary()
 
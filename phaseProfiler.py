@@ -0,0 +1,187 @@
+# Copyright 2012-2013 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+'''
+Per-phase profiling shared by the nova and swift tests.
+
+Each phase is run under cProfile and, where available, tracemalloc.  Threads
+started during a phase get a profiler of their own, and their stats are
+merged into the phase dump.  Without tracemalloc (Python 2) only the peak
+resident set size of the process is recorded.
+
+The wall-clock time of a phase is split into CPU time spent by this process
+(all threads), CPU time spent by child processes it waited on, and the
+remainder, which is time spent waiting on the cloud.  cProfile and
+tracemalloc add CPU time of their own, so with instrumentation on the split
+overstates Client CPU; use instrument=False for timings only.  When threads
+run CPU in parallel the remainder is no longer waiting time, and is left
+blank.
+'''
+
+#python libs
+import cProfile
+import csv
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+logger = logging.getLogger('phase_profiler')
+logger.setLevel(logging.INFO)
+
+
+class PhaseProfiler(object):
+    '''Profile named phases, writing dumps and a summary to output_dir.'''
+
+    def __init__(self, output_dir='profile', enabled=True, instrument=True):
+        self.output_dir = output_dir
+        self.enabled = enabled
+        self.instrument = instrument
+        self.phases = []
+        if enabled and instrument and not tracemalloc:
+            logger.warning('tracemalloc is unavailable, allocation tracking '
+                           'is limited to the peak RSS of the process')
+        if enabled and instrument and sys.version_info >= (3, 12):
+            logger.warning('Per-thread profilers are unavailable on Python '
+                           '3.12+, threads are profiled together and their '
+                           'call stacks may be interleaved')
+
+
+    def max_rss(self):
+        '''Peak resident set size of this process so far, in KB.'''
+        if not resource:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Profile the enclosed block as phase name, covering the calling
+        thread and any thread it starts.
+        '''
+        if not self.enabled:
+            yield
+            return
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        profile = None
+        threads = []
+        if self.instrument:
+            if tracemalloc:
+                tracemalloc.start()
+            lock = threading.Lock()
+            failed = []
+
+            def profile_thread(frame, event, arg):
+                # Called on the first event in each new thread; enabling the
+                # thread's own profiler replaces this hook.
+                thread_profile = cProfile.Profile()
+                try:
+                    thread_profile.enable()
+                except ValueError:
+                    # Another profiler is active; leave this thread alone.
+                    sys.setprofile(None)
+                    failed.append(True)
+                    return
+                with lock:
+                    threads.append(thread_profile)
+
+            # From 3.12 cProfile is built on sys.monitoring, which allows a
+            # single profiler per process, but that one sees every thread.
+            if sys.version_info < (3, 12):
+                threading.setprofile(profile_thread)
+            profile = cProfile.Profile()
+
+        before = os.times()
+        start = time.time()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                threading.setprofile(None)
+            wall = time.time() - start
+            after = os.times()
+
+            cpu = (after[0] - before[0]) + (after[1] - before[1])
+            children = (after[2] - before[2]) + (after[3] - before[3])
+            wait = wall - cpu - children
+            if wait < 0:
+                wait = None
+            peak = None
+
+            dump = os.path.join(self.output_dir, '{0}-{1}'.format(
+                                len(self.phases), name))
+            if profile:
+                if tracemalloc:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    top = tracemalloc.take_snapshot().statistics('lineno')[:25]
+                    tracemalloc.stop()
+                    with open(dump + '.alloc', 'w') as f:
+                        for stat in top:
+                            f.write('{0}\n'.format(stat))
+                stats = pstats.Stats(profile)
+                for thread_profile in threads:
+                    stats.add(thread_profile)
+                stats.dump_stats(dump + '.prof')
+                if failed:
+                    logger.warning('{0}: {1} threads could not be profiled, '
+                                   'another profiler was active'.format(
+                                       name, len(failed)))
+
+            self.phases.append({'phase': name, 'wall': wall, 'cpu': cpu,
+                                'children': children, 'wait': wait,
+                                'peak': peak, 'rss': self.max_rss()})
+            logger.info('{0}: {1:.2f}s wall, {2:.2f}s cpu, {3:.2f}s child '
+                        'cpu, {4} waiting'.format(
+                            name, wall, cpu, children,
+                            'unknown' if wait is None else
+                            '{0:.2f}s'.format(wait)))
+
+
+    def summary(self):
+        '''Write the per-phase CPU/wait split to summary.csv.'''
+        if not self.enabled or not self.phases:
+            return
+
+        name = os.path.join(self.output_dir, 'summary.csv')
+        with open(name, 'w+b') as f:
+            output = csv.writer(f)
+            output.writerow(['Phase', 'Wall time', 'Client CPU',
+                             'Child CPU', 'Waiting', 'Peak allocated',
+                             'Max RSS KB', 'Instrumented'])
+            for p in self.phases:
+                output.writerow([p['phase'], p['wall'], p['cpu'],
+                                 p['children'], p['wait'], p['peak'],
+                                 p['rss'], self.instrument])
+        logger.info('Profile summary written to {0}'.format(name))
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+# Copyright 2012-2013 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+'''
+Run the nova and swift suites side by side from a single scenario file.
+
+Each suite runs in its own process.  Phases and per-instance timings are
+reported back relative to a shared start time, so the effect of one
+workload on the other can be read off a single timeline.  A scenario file
+is JSON, for example:
+
+    {
+        "name": "boot_under_load",
+        "deadline": 3600,
+        "nova": {"name": "nova_test", "count": 5, "timeout": 20,
+                 "flavor": "standard.xsmall",
+                 "image": "Ubuntu Precise 12.04 LTS Server 64-bit"},
+        "swift": {"name": "swift_test", "phases": ["stress", "soak"],
+                  "count": 10, "size": 1048576, "soak": 1800,
+                  "concurrency": 4}
+    }
+
+Credentials are read from the same OS_* environment variables as
+novaTest.py and swiftTest.py.  Any suite that fails or is still running at
+the deadline is stopped and its instances or containers are removed.
+'''
+
+#python libs
+import csv
+import json
+import logging
+import multiprocessing as mp
+import os
+import signal
+import sys
+import traceback
+from datetime import datetime
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(path, 'swift'))
+sys.path.insert(0, os.path.join(path, 'nova'))
+
+from novaTest import NovaServiceTest
+from swiftTest import SwiftServiceTest
+
+
+logger = logging.getLogger('scenario')
+logger.setLevel(logging.INFO)
+
+
+def nova_service(conf):
+    return NovaServiceTest(username=os.environ['OS_USERNAME'],
+                           password=os.environ['OS_PASSWORD'],
+                           tenant=os.environ['OS_TENANT_NAME'],
+                           auth_url=os.environ['OS_AUTH_URL'],
+                           region=os.environ['OS_REGION_NAME'],
+                           keypair=os.environ['OS_KEYPAIR'],
+                           instance_name=conf.get('name', 'nova_test'),
+                           count=conf.get('count', 20),
+                           timeout=conf.get('timeout', 20),
+                           floating_ips=conf.get('floating_ips', False),
+                           floating_pool=conf.get('floating_pool'),
+                           floating_wait=conf.get('floating_wait', 5),
+                           reachable_timeout=conf.get('reachable_timeout', 2))
+
+
+def swift_service(conf):
+    return SwiftServiceTest(username=os.environ['OS_USERNAME'],
+                            password=os.environ['OS_PASSWORD'],
+                            tenant=os.environ['OS_TENANT_NAME'],
+                            auth_url=os.environ['OS_AUTH_URL'],
+                            swift_url=os.environ['OS_OBJECT_URL'],
+                            auth_ver=conf.get('auth_ver', '2.0'),
+                            retries=conf.get('retries', 3))
+
+
+class Worker(object):
+    '''Runs one suite's phases and reports them to the parent process.'''
+
+    def __init__(self, suite, conf, epoch, events):
+        self.suite = suite
+        self.conf = conf
+        self.epoch = epoch
+        self.events = events
+        self.terminated = False
+
+    def offset(self, when):
+        return (when - self.epoch).total_seconds()
+
+    def event(self, phase, start, end, status='ok'):
+        self.events.put({'suite': self.suite, 'phase': phase,
+                         'start': self.offset(start),
+                         'end': self.offset(end),
+                         'status': status})
+
+    def phase(self, name, func, *args, **kwargs):
+        start = datetime.now()
+        logger.info('{0}: starting {1}'.format(self.suite, name))
+        try:
+            retval = func(*args, **kwargs)
+        except BaseException:
+            status = 'terminated' if self.terminated else 'failed'
+            self.event(name, start, datetime.now(), status=status)
+            raise
+        self.event(name, start, datetime.now())
+        return retval
+
+    def __call__(self):
+        def terminate_handler(signum, frame):
+            '''
+            Trap SIGTERM from the deadline so the running phase unwinds
+            through phase() and still reports its event.
+            '''
+            self.terminated = True
+            sys.exit('Terminated at the deadline')
+        signal.signal(signal.SIGTERM, terminate_handler)
+
+        try:
+            getattr(self, 'run_' + self.suite)()
+        except BaseException:
+            logger.error('{0} failed:\n{1}'.format(self.suite,
+                                                   traceback.format_exc()))
+            sys.exit(1)
+
+    def run_nova(self):
+        conf = self.conf
+        nova_test = nova_service(conf)
+
+        def alarm_handler(signum, frame):
+            logger.error("Maximum lifespan greater than {0}".format(
+                         nova_test.timeout))
+            nova_test.dieGracefully()
+        signal.signal(signal.SIGALRM, alarm_handler)
+
+        nova_test.connect()
+        nova_test.cleanup()
+        nova_test.set_flavor(conf['flavor'])
+        nova_test.set_image(conf['image'])
+
+        signal.alarm(nova_test.timeout*60)
+        self.phase('create', nova_test.create)
+        signal.alarm(0)
+
+        if conf.get('tests', True):
+            self.phase('other_tests', nova_test.other_tests)
+
+        signal.alarm(nova_test.timeout*60)
+        self.phase('delete', nova_test.delete)
+        signal.alarm(0)
+
+        for i, server in nova_test.server.items():
+            t = server['time']
+            self.event('create:{0}'.format(i), t['create_start'],
+                       t['create_end'])
+            if 'ip_seen' in t:
+                self.event('ip:{0}'.format(i), t['create_start'],
+                           t['ip_seen'])
+            if 'fip_reachable' in t:
+                self.event('floating_ip:{0}'.format(i), t['fip_start'],
+                           t['fip_reachable'])
+            self.event('delete:{0}'.format(i),
+                       t['delete_end'] - t['delete_total'], t['delete_end'])
+
+        self.phase('results', nova_test.results)
+
+    def run_swift(self):
+        conf = self.conf
+        name = conf.get('name', 'swift_test')
+        concurrency = conf.get('concurrency', 4)
+        sst = swift_service(conf)
+        sst.connect()
+
+        for phase in conf.get('phases', ['api', 'stress']):
+            if phase == 'api':
+                self.phase(phase, sst.test_api, test_name=name)
+            elif phase == 'stress':
+                self.phase(phase, sst.stress_test, test_name=name,
+                           count=conf.get('count', 10),
+                           size=conf.get('size', 2**20))
+            elif phase == 'large':
+                self.phase(phase, sst.large_object_test, test_name=name,
+                           size=conf.get('large_size', 2**30),
+                           segment_size=conf.get('segment_size', 2**26),
+                           concurrency=concurrency,
+                           manifest=conf.get('manifest', 'slo'),
+                           timeout=conf.get('manifest_timeout', 300))
+            elif phase == 'list':
+                self.phase(phase, sst.listing_test, test_name=name,
+                           concurrency=concurrency)
+            elif phase == 'soak':
+                self.phase(phase, sst.soak_test, test_name=name,
+                           duration=conf.get('soak', 600),
+                           size=conf.get('size', 2**20),
+                           concurrency=concurrency,
+                           interval=conf.get('soak_interval', 60))
+            else:
+                raise ValueError('Unknown swift phase: {0}'.format(phase))
+
+
+def cleanup(suite, conf):
+    '''Remove anything a stopped or failed suite may have left behind.'''
+    logger.warning('Cleaning up after {0}'.format(suite))
+    if suite == 'nova':
+        nova_test = nova_service(conf)
+        nova_test.connect()
+        nova_test.cleanup(die=False)
+    elif suite == 'swift':
+        sst = swift_service(conf)
+        sst.teardown(prefix=conf.get('name', 'swift_test'),
+                     concurrency=conf.get('concurrency', 4))
+
+
+def run(scenario):
+    '''Run every suite in scenario until done or the deadline passes.'''
+    suites = [s for s in ('nova', 'swift') if s in scenario]
+    deadline = scenario.get('deadline', 3600)
+
+    epoch = datetime.now()
+    events = mp.Queue()
+    procs = {}
+    for suite in suites:
+        worker = Worker(suite, scenario[suite], epoch, events)
+        procs[suite] = mp.Process(target=worker, name=suite)
+        procs[suite].start()
+
+    # Keep draining the queue while waiting: a child cannot exit until
+    # everything it has put on the queue has been read.
+    results = []
+    while [p for p in procs.values() if p.is_alive()]:
+        remaining = deadline - (datetime.now() - epoch).total_seconds()
+        if remaining <= 0:
+            break
+        try:
+            results.append(events.get(timeout=min(remaining, 1)))
+        except Empty:
+            pass
+
+    stopped = set()
+    for suite, proc in procs.items():
+        if proc.is_alive():
+            stopped.add(suite)
+            logger.error('{0} still running at the {1}s deadline, stopping'
+                         .format(suite, deadline))
+            proc.terminate()
+
+    # Give stopped workers a grace period to report their last phase.
+    grace = datetime.now()
+    while [p for p in procs.values() if p.is_alive()]:
+        if (datetime.now() - grace).total_seconds() > 30:
+            for proc in procs.values():
+                if proc.is_alive():
+                    os.kill(proc.pid, signal.SIGKILL)
+        try:
+            results.append(events.get(timeout=1))
+        except Empty:
+            pass
+    while True:
+        try:
+            results.append(events.get(timeout=1))
+        except Empty:
+            break
+    for suite, proc in procs.items():
+        proc.join()
+        if proc.exitcode != 0:
+            # Whatever broke the suite may break its cleanup too; that must
+            # not stop the other suite's cleanup or the report.
+            start = datetime.now()
+            status = 'ok'
+            try:
+                cleanup(suite, scenario[suite])
+            except Exception:
+                logger.error('Cleaning up {0} failed:\n{1}'.format(
+                             suite, traceback.format_exc()))
+                status = 'failed'
+            results.append({'suite': suite, 'phase': 'cleanup',
+                            'start': (start - epoch).total_seconds(),
+                            'end': (datetime.now() - epoch).total_seconds(),
+                            'status': status})
+
+    end = (datetime.now() - epoch).total_seconds()
+    for suite, proc in procs.items():
+        status = 'ok' if proc.exitcode == 0 else 'failed'
+        if suite in stopped:
+            status = 'terminated'
+        results.append({'suite': suite, 'phase': 'total', 'start': 0,
+                        'end': end, 'status': status})
+    return epoch, sorted(results, key=lambda e: (e['start'], e['suite']))
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    op = OptionParser(usage='%prog [options] scenario.json')
+    op.add_option('-l', '--log-level', dest='log_level', type=str,
+                  default='info', help='Logging output level.')
+    op.add_option('-d', '--deadline', dest='deadline', type=int,
+                  default=None, help='Override the scenario deadline '
+                  '(in seconds).')
+    options, args = op.parse_args()
+    if len(args) != 1:
+        op.error('A scenario file is required.')
+
+    if options.log_level.upper() in ['DEBUG', 'INFO', 'WARNING', 'ERROR',
+                                     'CRITICAL']:
+        logger.setLevel(getattr(logging, options.log_level.upper()))
+
+    with open(args[0]) as f:
+        scenario = json.load(f)
+    if options.deadline is not None:
+        scenario['deadline'] = options.deadline
+
+    epoch, results = run(scenario)
+
+    name = 'scenario-{0}-{1}.csv'.format(scenario.get('name', 'scenario'),
+                                         epoch.strftime('%Y%m%d%H%M%S'))
+    with open(name, 'w+b') as csvfile:
+        output = csv.writer(csvfile)
+        output.writerow(['Suite', 'Phase', 'Start', 'End', 'Duration',
+                         'Status'])
+        for e in results:
+            output.writerow([e['suite'], e['phase'], e['start'], e['end'],
+                             e['end'] - e['start'], e['status']])
+    logger.info('Results written to {0}'.format(name))
+
+    if [e for e in results if e['phase'] == 'total' and
+                              e['status'] != 'ok']:
+        sys.exit(1)
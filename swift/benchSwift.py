@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Copyright 2012-2013 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+'''
+Benchmark SwiftServiceTest itself by running it against a local FakeSwift.
+
+The fake cluster runs in a separate process so that the CPU time measured
+here belongs to the harness alone.
+'''
+
+#python libs
+import csv
+import json
+import multiprocessing as mp
+import os
+from datetime import datetime
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+from fakeSwift import FakeSwift
+from swiftTest import SwiftServiceTest
+
+
+def serve(queue, latency, error_rate):
+    fake = FakeSwift(latency=latency, error_rate=error_rate)
+    queue.put((fake.base_url, fake.auth_url, fake.swift_url))
+    fake.serve_forever()
+
+
+def served_stats(base_url):
+    return json.loads(urlopen(base_url + '/fake/stats').read())
+
+
+def bench(base_url, name, func, *args, **kwargs):
+    '''
+    Run func and return (name, ops, wall seconds, client cpu seconds,
+    injected errors, whether func failed).  A failure is reported rather
+    than raised so the remaining tests still run.
+    '''
+    before = served_stats(base_url)
+    cpu = sum(os.times()[:2])
+    start = datetime.now()
+    failed = False
+    try:
+        func(*args, **kwargs)
+    except Exception as e:
+        print("{0} failed: {1}".format(name, e))
+        failed = True
+    wall = (datetime.now() - start).total_seconds()
+    cpu = sum(os.times()[:2]) - cpu
+    after = served_stats(base_url)
+    ops = after['requests'] - before['requests']
+    errors = after['errors'] - before['errors']
+    print("{0}: {1} ops in {2:.3f}s, {3:.1f} ops/s, {4} errors, {5:.3f} ms "
+          "CPU/op".format(name, ops, wall, ops / wall, errors,
+                          1000.0 * cpu / max(ops, 1)))
+    return name, ops, wall, cpu, errors, failed
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    op = OptionParser()
+    op.add_option('-n', '--name', dest='name', default="swift_bench",
+                  help="Name to prepend to containers")
+    op.add_option('-c', '--stress-count', dest='count', default=10, type=int,
+                  help="Number of containers and objects-per-container.")
+    op.add_option('--stress-size', dest='size', default=2**10, type=int,
+                  help="Size (in bytes) of each object created")
+    op.add_option('--latency', dest='latency', default=0.0, type=float,
+                  help="Seconds of latency added to every storage request.")
+    op.add_option('--error-rate', dest='error_rate', default=0.0, type=float,
+                  help="Fraction of storage requests failed with a 503.")
+    options, args = op.parse_args()
+
+    queue = mp.Queue()
+    server = mp.Process(target=serve, args=(queue, options.latency,
+                                            options.error_rate))
+    server.daemon = True
+    server.start()
+    base_url, auth_url, swift_url = queue.get()
+
+    try:
+        sst = SwiftServiceTest(username='test', password='test',
+                               tenant='test', auth_url=auth_url,
+                               auth_ver='1.0', swift_url=swift_url)
+        sst.connect()
+
+        results = [bench(base_url, 'test_api', sst.test_api,
+                         test_name=options.name),
+                   bench(base_url, 'stress_test', sst.stress_test,
+                         test_name=options.name, count=options.count,
+                         size=options.size)]
+
+        # A failed test leaves its containers behind.
+        if [r for r in results if r[5]]:
+            try:
+                sst.teardown(prefix=options.name)
+            except Exception as e:
+                print("Teardown failed: {0}".format(e))
+    finally:
+        server.terminate()
+        server.join()
+
+    name = 'bench-{0}-{1}-{2}-{3}-{4}.csv'.format(options.name, options.count,
+                                                  options.size,
+                                                  options.latency,
+                                                  options.error_rate)
+    with open(name, 'w+b') as csvfile:
+        output = csv.writer(csvfile)
+        output.writerow(['Test', 'Ops', 'Wall time', 'Ops/s', 'Errors',
+                         'CPU ms/op', 'Failed'])
+        for test, ops, wall, cpu, errors, failed in results:
+            output.writerow([test, ops, wall, ops / wall, errors,
+                             1000.0 * cpu / max(ops, 1), failed])
@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+
+# Copyright 2012-2013 Hewlett-Packard Development Company, L.P.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+'''
+A small in-memory stand-in for a Swift proxy and its auth endpoint.
+
+It implements enough of the account, container and object API for
+SwiftServiceTest to run against it offline: v1.0 and v2.0 auth, paginated
+JSON listings, container metadata, ranged GETs, static and dynamic large
+objects, bulk delete and /info.  Latency and error rates can be injected,
+and tokens can be made to expire.
+'''
+
+#python libs
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
+
+
+logger = logging.getLogger('fake_swift')
+
+ACCOUNT = 'AUTH_test'
+
+
+class FakeSwiftHandler(BaseHTTPRequestHandler):
+    '''Dispatch each request to the FakeSwift instance owning the server.'''
+
+    protocol_version = 'HTTP/1.1'
+    # Buffer replies so headers and body leave in one segment; writing them
+    # separately trips Nagle and delayed ACKs on keep-alive connections.
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def handle_one_request(self):
+        # BaseHTTPRequestHandler looks up do_<METHOD>; route everything
+        # through a single dispatcher instead.
+        self.raw_requestline = self.rfile.readline(65537)
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if not self.parse_request():
+            return
+        self.server.fake.handle(self)
+        self.wfile.flush()
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def reply(self, status, body=b'', headers=None):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeSwift(object):
+    '''In-memory Swift cluster served over HTTP on a background thread.'''
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0,
+                 token_ttl=None, listing_limit=10000):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.listing_limit = listing_limit
+
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.containers = {}
+        self.requests = 0
+        self.errors = 0
+
+        self.httpd = ThreadingHTTPServer((host, port), FakeSwiftHandler)
+        self.httpd.fake = self
+        self.thread = None
+
+        host, port = self.httpd.server_address[:2]
+        self.base_url = 'http://{0}:{1}'.format(host, port)
+        self.auth_url = self.base_url + '/auth/v1.0'
+        self.auth_url_v2 = self.base_url + '/v2.0'
+        self.swift_url = '{0}/v1/{1}'.format(self.base_url, ACCOUNT)
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+
+    def new_token(self):
+        token = 'AUTH_tk' + uuid.uuid4().hex
+        expires = None
+        if self.token_ttl is not None:
+            expires = time.time() + self.token_ttl
+        with self.lock:
+            # Forget expired tokens so a long soak does not grow the dict.
+            now = time.time()
+            for old, old_expires in list(self.tokens.items()):
+                if old_expires is not None and old_expires < now:
+                    del self.tokens[old]
+            self.tokens[token] = expires
+        return token, expires
+
+
+    def valid_token(self, token):
+        with self.lock:
+            if token not in self.tokens:
+                return False
+            expires = self.tokens[token]
+        return expires is None or time.time() < expires
+
+
+    def handle(self, req):
+        url = urlparse(req.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        parts = [unquote(p) for p in url.path.split('/')[1:]]
+
+        if parts[:1] == ['auth']:
+            return self.auth_v1(req)
+        if parts[:2] == ['v2.0', 'tokens']:
+            return self.auth_v2(req)
+        if parts == ['info']:
+            return self.info(req)
+        if parts == ['fake', 'stats']:
+            with self.lock:
+                stats = {'requests': self.requests, 'errors': self.errors}
+            return req.reply(200, json.dumps(stats))
+        if parts[:2] != ['v1', ACCOUNT]:
+            req.read_body()
+            return req.reply(404)
+
+        body = req.read_body()
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.valid_token(req.headers.get('X-Auth-Token')):
+            return req.reply(401, 'Unauthorized')
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            return req.reply(503, 'Injected failure')
+
+        container = parts[2] if len(parts) > 2 and parts[2] else None
+        obj = '/'.join(parts[3:]) if len(parts) > 3 else None
+        with self.lock:
+            if obj:
+                return self.object(req, query, body, container, obj)
+            if container:
+                return self.container(req, query, body, container)
+            return self.account(req, query, body)
+
+
+    def auth_v1(self, req):
+        req.read_body()
+        if not req.headers.get('X-Auth-User'):
+            return req.reply(401, 'Unauthorized')
+        token, expires = self.new_token()
+        return req.reply(200, headers={'X-Storage-Url': self.swift_url,
+                                       'X-Auth-Token': token,
+                                       'X-Storage-Token': token})
+
+
+    def auth_v2(self, req):
+        creds = json.loads(req.read_body().decode('utf-8'))['auth']
+        tenant = creds.get('tenantName', 'test')
+        token, expires = self.new_token()
+        if expires is None:
+            expires = time.time() + 86400
+        expires = datetime.utcfromtimestamp(expires).isoformat() + 'Z'
+        endpoint = {'id': 'fake', 'region': 'RegionOne',
+                    'publicURL': self.swift_url,
+                    'internalURL': self.swift_url,
+                    'adminURL': self.base_url + '/v1'}
+        access = {'token': {'id': token, 'expires': expires,
+                            'issued_at': datetime.utcnow().isoformat(),
+                            'tenant': {'id': ACCOUNT, 'name': tenant,
+                                       'enabled': True}},
+                  'user': {'id': 'fake', 'name': 'fake', 'roles': [],
+                           'roles_links': []},
+                  'serviceCatalog': [{'type': 'object-store',
+                                      'name': 'swift',
+                                      'endpoints': [endpoint],
+                                      'endpoints_links': []}],
+                  'metadata': {'is_admin': 0, 'roles': []}}
+        return req.reply(200, json.dumps({'access': access}),
+                         headers={'Content-Type': 'application/json'})
+
+
+    def info(self, req):
+        req.read_body()
+        info = {'swift': {'version': 'fake'},
+                'bulk_delete': {'max_deletes_per_request': 10000,
+                                'max_failed_deletes': 1000},
+                'slo': {'max_manifest_segments': 1000,
+                        'min_segment_size': 1}}
+        return req.reply(200, json.dumps(info),
+                         headers={'Content-Type': 'application/json'})
+
+
+    def listing(self, req, query, names, entry):
+        '''Reply with one page of a JSON or plain text listing.'''
+        marker = query.get('marker', [''])[0]
+        end_marker = query.get('end_marker', [''])[0]
+        prefix = query.get('prefix', [''])[0]
+        limit = min(int(query.get('limit', [self.listing_limit])[0]),
+                    self.listing_limit)
+
+        page = []
+        for name in sorted(names):
+            if len(page) >= limit:
+                break
+            if name <= marker or not name.startswith(prefix):
+                continue
+            if end_marker and name >= end_marker:
+                break
+            page.append(name)
+
+        if query.get('format', [''])[0] == 'json':
+            body = json.dumps([entry(name) for name in page])
+            ctype = 'application/json; charset=utf-8'
+        else:
+            body = ''.join(name + '\n' for name in page)
+            ctype = 'text/plain; charset=utf-8'
+        if not page:
+            return 204, '', ctype
+        return 200, body, ctype
+
+
+    def account(self, req, query, body):
+        if req.command == 'POST' and 'bulk-delete' in query:
+            return self.bulk_delete(req, body)
+
+        headers = {
+            'X-Account-Container-Count': len(self.containers),
+            'X-Account-Object-Count': sum(len(c['objects']) for c in
+                                          self.containers.values()),
+            'X-Account-Bytes-Used': sum(self.bytes_used(c) for c in
+                                        self.containers.values()),
+        }
+        if req.command == 'HEAD':
+            return req.reply(204, headers=headers)
+        if req.command == 'GET':
+            def entry(name):
+                cont = self.containers[name]
+                return {'name': name, 'count': len(cont['objects']),
+                        'bytes': self.bytes_used(cont)}
+            status, body, headers['Content-Type'] = \
+                    self.listing(req, query, self.containers, entry)
+            return req.reply(status, body, headers=headers)
+        return req.reply(405)
+
+
+    def container(self, req, query, body, name):
+        cont = self.containers.get(name)
+        if req.command == 'PUT':
+            status = 202 if cont else 201
+            if not cont:
+                cont = self.containers[name] = {'meta': {}, 'objects': {}}
+            cont['meta'].update(self.meta(req, 'x-container-meta-'))
+            return req.reply(status)
+        if cont is None:
+            return req.reply(404, 'Not Found')
+
+        headers = dict(cont['meta'])
+        headers['X-Container-Object-Count'] = len(cont['objects'])
+        headers['X-Container-Bytes-Used'] = self.bytes_used(cont)
+        if req.command == 'POST':
+            cont['meta'].update(self.meta(req, 'x-container-meta-'))
+            return req.reply(204)
+        if req.command == 'HEAD':
+            return req.reply(204, headers=headers)
+        if req.command == 'GET':
+            def entry(oname):
+                o = cont['objects'][oname]
+                return {'name': oname, 'hash': o['etag'],
+                        'bytes': len(o['data']),
+                        'content_type': 'application/octet-stream',
+                        'last_modified': o['last_modified']}
+            status, body, headers['Content-Type'] = \
+                    self.listing(req, query, cont['objects'], entry)
+            return req.reply(status, body, headers=headers)
+        if req.command == 'DELETE':
+            if cont['objects']:
+                return req.reply(409, 'Conflict')
+            del self.containers[name]
+            return req.reply(204)
+        return req.reply(405)
+
+
+    def object(self, req, query, body, cname, oname):
+        cont = self.containers.get(cname)
+        if cont is None:
+            return req.reply(404, 'Not Found')
+        obj = cont['objects'].get(oname)
+
+        if req.command == 'PUT':
+            obj = {'data': body, 'etag': hashlib.md5(body).hexdigest(),
+                   'meta': self.meta(req, 'x-object-meta-'),
+                   'last_modified': datetime.utcnow().isoformat(),
+                   'slo': None,
+                   'dlo': req.headers.get('X-Object-Manifest')}
+            if 'multipart-manifest' in query:
+                obj['slo'] = json.loads(body.decode('utf-8'))
+                for seg in obj['slo']:
+                    segment = self.lookup(seg['path'])
+                    if segment is None or (seg.get('etag') and
+                                           seg['etag'] != segment['etag']):
+                        return req.reply(400, 'Bad segment {0}'
+                                         .format(seg['path']))
+                obj['data'] = b''
+            cont['objects'][oname] = obj
+            return req.reply(201, headers={'Etag': obj['etag']})
+
+        if obj is None:
+            return req.reply(404, 'Not Found')
+        if req.command == 'DELETE':
+            if obj['slo'] and 'multipart-manifest' in query:
+                for seg in obj['slo']:
+                    seg_cname, seg_oname = seg['path'].lstrip('/').split('/', 1)
+                    self.containers.get(seg_cname, {}).get('objects', {}) \
+                            .pop(seg_oname, None)
+            del cont['objects'][oname]
+            return req.reply(204)
+        if req.command == 'POST':
+            obj['meta'] = self.meta(req, 'x-object-meta-')
+            return req.reply(202)
+        if req.command not in ('GET', 'HEAD'):
+            return req.reply(405)
+
+        data = self.contents(obj)
+        headers = dict(obj['meta'])
+        headers['Etag'] = obj['etag']
+        headers['Content-Type'] = 'application/octet-stream'
+        headers['Accept-Ranges'] = 'bytes'
+        status = 200
+        rng = req.headers.get('Range')
+        if rng and rng.startswith('bytes='):
+            start, end = rng[len('bytes='):].split('-')
+            if not start:
+                start, end = max(len(data) - int(end), 0), len(data) - 1
+            else:
+                start = int(start)
+                end = min(int(end) if end else len(data) - 1, len(data) - 1)
+            if start >= len(data):
+                return req.reply(416, 'Requested Range Not Satisfiable')
+            headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end,
+                                                                  len(data))
+            data = data[start:end + 1]
+            status = 206
+        return req.reply(status, data, headers=headers)
+
+
+    def bulk_delete(self, req, body):
+        deleted = not_found = 0
+        errors = []
+        for line in body.decode('utf-8').splitlines():
+            path = unquote(line.strip()).lstrip('/')
+            if not path:
+                continue
+            cname, _sep, oname = path.partition('/')
+            cont = self.containers.get(cname)
+            if oname:
+                if cont and cont['objects'].pop(oname, None) is not None:
+                    deleted += 1
+                else:
+                    not_found += 1
+            elif cont is None:
+                not_found += 1
+            elif cont['objects']:
+                errors.append([path, '409 Conflict'])
+            else:
+                del self.containers[cname]
+                deleted += 1
+        result = {'Number Deleted': deleted, 'Number Not Found': not_found,
+                  'Errors': errors, 'Response Body': '',
+                  'Response Status': '400 Bad Request' if errors
+                                     else '200 OK'}
+        return req.reply(200, json.dumps(result),
+                         headers={'Content-Type': 'application/json'})
+
+
+    def lookup(self, path):
+        cname, _sep, oname = path.lstrip('/').partition('/')
+        return self.containers.get(cname, {}).get('objects', {}).get(oname)
+
+
+    def contents(self, obj):
+        '''Return the full body of obj, assembling large objects.'''
+        if obj['slo'] is not None:
+            return b''.join(self.contents(self.lookup(seg['path']))
+                            for seg in obj['slo'])
+        if obj['dlo']:
+            cname, _sep, prefix = obj['dlo'].partition('/')
+            objects = self.containers.get(cname, {}).get('objects', {})
+            return b''.join(self.contents(objects[name])
+                            for name in sorted(objects)
+                            if name.startswith(prefix))
+        return obj['data']
+
+
+    def bytes_used(self, cont):
+        return sum(len(o['data']) for o in cont['objects'].values())
+
+
+    def meta(self, req, prefix):
+        return dict((key.title(), value) for key, value in req.headers.items()
+                    if key.lower().startswith(prefix))
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    op = OptionParser()
+    op.add_option('-p', '--port', dest='port', default=8080, type=int,
+                  help="Port to listen on.")
+    op.add_option('--latency', dest='latency', default=0.0, type=float,
+                  help="Seconds of latency added to every storage request.")
+    op.add_option('--error-rate', dest='error_rate', default=0.0, type=float,
+                  help="Fraction of storage requests failed with a 503.")
+    op.add_option('--token-ttl', dest='token_ttl', default=None, type=float,
+                  help="Seconds before an issued token expires.")
+    options, args = op.parse_args()
+
+    fake = FakeSwift(port=options.port, latency=options.latency,
+                     error_rate=options.error_rate,
+                     token_ttl=options.token_ttl)
+    print("OS_AUTH_URL={0}".format(fake.auth_url))
+    print("OS_OBJECT_URL={0}".format(fake.swift_url))
+    fake.serve_forever()
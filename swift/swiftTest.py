@@ -19,16 +19,85 @@
 #python libs
 import os
 import csv
+import json
 import hashlib
-from datetime import datetime
+import logging
+import socket
+import sys
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from time import sleep
+try:
+    from httplib import HTTPException
+    from urllib import quote
+    from urlparse import urlparse
+except ImportError:
+    from http.client import HTTPException
+    from urllib.parse import quote, urlparse
+try:
+    from requests.exceptions import RequestException
+except ImportError:
+    RequestException = HTTPException
 
 #swift libs
 from swiftclient import client as swift
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from phaseProfiler import PhaseProfiler
+
+
+def bounded_imap(func, iterable, concurrency):
+    '''
+    Apply func to each item of iterable using a pool of concurrency threads.
+    Items are only pulled from iterable when a worker is free, and results
+    are yielded in input order, so at most concurrency items are in memory.
+    '''
+    pool = ThreadPool(concurrency)
+    pending = deque()
+    try:
+        for item in iterable:
+            if len(pending) >= concurrency:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(func, (item,)))
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def batches(iterable, size):
+    '''Yield lists of up to size items from iterable.'''
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def utf8(value):
+    '''Return a name from a JSON listing as a UTF-8 native string.'''
+    if str is bytes and not isinstance(value, bytes):
+        return value.encode('utf-8')
+    return value
+
+
+def percentile(values, fraction):
+    '''Return the given fraction percentile of a sorted list of values.'''
+    if not values:
+        return 0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
 class SwiftServiceTest(object):
 
     def __init__(self, username=None, password=None, tenant=None,
-                 auth_url=None, auth_ver='2.0', swift_url=None, debug=False):
+                 auth_url=None, auth_ver='2.0', swift_url=None, debug=False,
+                 retries=3, profiler=None):
 
         self.username = username
         self.password = password
@@ -37,19 +106,24 @@ class SwiftServiceTest(object):
         self.swift_url = swift_url
         self.auth_ver = auth_ver
         self.debug = debug
+        self.retries = retries
+        self.profiler = profiler or PhaseProfiler(enabled=False)
         self.token = None
         self.http_conn = None
+        self.reauths = 0
+        self.reconnects = 0
+        self.server_errors = 0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self._auth_lock = threading.Lock()
+        self.page_callback = None
 
 
     def connect(self, force=False):
         if self.http_conn is not None and not force:
             return
 
-        swift_url, self.token = swift.get_auth(auth_url=self.auth_url,
-                                               user=self.username,
-                                               key=self.password,
-                                               auth_version=self.auth_ver,
-                                               tenant_name=self.tenant)
+        swift_url = self.authenticate()
         if self.debug:
             print(self.auth_url)
             print(self.token)
@@ -60,54 +134,169 @@ class SwiftServiceTest(object):
             print("Different swift_url returned from swift")
 
         self.http_conn = swift.http_connection(self.swift_url)
+        self._local = threading.local()
+        self._local.http_conn = self.http_conn
 
         if self.debug:
             print(self.http_conn)
             print
 
 
-    def get_account(self, deep=True):
+    def authenticate(self):
+        '''Fetch a new token, returning the storage url from the catalog.'''
+        swift_url, self.token = swift.get_auth(auth_url=self.auth_url,
+                                               user=self.username,
+                                               key=self.password,
+                                               auth_version=self.auth_ver,
+                                               tenant_name=self.tenant)
+        return swift_url
+
+
+    def reauthenticate(self, stale_token):
+        '''
+        Replace an expired token.  Threads that hit a 401 with the same
+        token only authenticate once between them.
+        '''
+        with self._auth_lock:
+            if self.token == stale_token:
+                self.authenticate()
+                self.reauths += 1
+                if self.debug:
+                    print("Token refreshed")
+
+
+    def reconnect(self):
+        '''Drop the calling thread's connection so the next call opens one.'''
+        self._local.http_conn = None
+        self.count('reconnects')
+        if self.debug:
+            print("Reconnecting")
+
+
+    def count(self, attr):
+        '''Increment the counter attr, which threads share.'''
+        with self._stats_lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+
+    def call(self, func, **kwargs):
+        '''
+        Call the swiftclient function func with our url, token and this
+        thread's connection.  An expired token is refreshed, a dropped
+        connection reopened and a 5xx reply backed off from, and the call
+        retried, up to self.retries times.
+        '''
+        for attempt in range(self.retries + 1):
+            token = self.token
+            try:
+                return func(url=self.swift_url, token=token,
+                            http_conn=self.thread_conn(), **kwargs)
+            except swift.ClientException as e:
+                if attempt == self.retries:
+                    raise
+                if e.http_status == 401:
+                    self.reauthenticate(token)
+                elif e.http_status is not None and e.http_status >= 500:
+                    self.count('server_errors')
+                    sleep(0.1 * 2 ** attempt)
+                else:
+                    raise
+            except (socket.error, HTTPException, RequestException):
+                # requests-based swiftclient raises requests' own
+                # ConnectionError, which is neither of the others on
+                # Python 2.
+                if attempt == self.retries:
+                    raise
+                self.reconnect()
+
+
+    def list_containers(self, prefix=None):
+        '''
+        Yield every container in the account, fetching one page at a time
+        and reporting how long each page took to self.page_callback.
+        '''
+        marker = ''
+        while True:
+            start = datetime.now()
+            headers, page = self.call(swift.get_account, marker=marker,
+                                      prefix=prefix)
+            if self.page_callback:
+                self.page_callback('', len(page), datetime.now() - start)
+            if not page:
+                return
+            for container in page:
+                yield container
+            marker = page[-1]['name']
+
+
+    def list_objects(self, cname, prefix=None):
+        '''
+        Yield every object in container cname, fetching one page at a time
+        and reporting how long each page took to self.page_callback.
+        '''
+        marker = ''
+        while True:
+            start = datetime.now()
+            headers, page = self.call(swift.get_container, container=cname,
+                                      marker=marker, prefix=prefix)
+            if self.page_callback:
+                self.page_callback(cname, len(page), datetime.now() - start)
+            if not page:
+                return
+            for obj in page:
+                yield obj
+            marker = page[-1]['name']
+
+
+    def get_account(self, deep=True, concurrency=4):
         if not self.http_conn:
             self.connect()
 
-        account_info = swift.head_account(url=self.swift_url,
-                                          token=self.token,
-                                          http_conn=self.http_conn)
-        account_head, containers = swift.get_account(url=self.swift_url,
-                                                     token=self.token,
-                                                     http_conn=self.http_conn)
+        account_info = self.call(swift.head_account)
         if self.debug:
             print(account_info)
-            print(account_head)
-            for container in containers:
-                print(container)
-            print
 
+        containers = self.list_containers()
         if deep:
-            self.get_containers(containers)
+            return self.get_containers(containers, concurrency=concurrency)
 
-
-    def get_containers(self, containers):
+        count = 0
         for container in containers:
-            info, objects = swift.get_container(url=self.swift_url,
-                                                token=self.token,
-                                                http_conn=self.http_conn,
-                                                container=container['name'])
             if self.debug:
-                print(container['name'])
-                print(info)
-                for obj in objects:
+                print(container)
+            count += 1
+        if self.debug:
+            print
+        return count
+
+
+    def get_containers(self, containers, concurrency=4):
+        '''
+        Walk the full listing of each container, concurrency containers at
+        a time.  Listings are consumed as they arrive rather than stored.
+        Returns the total number of objects seen.
+        '''
+        def walk(container):
+            count = 0
+            for obj in self.list_objects(container['name']):
+                if self.debug:
                     print(obj)
-                print
+                count += 1
+            return container['name'], count
+
+        total = 0
+        for name, count in bounded_imap(walk, containers, concurrency):
+            if self.debug:
+                print("Container {0}: {1} objects".format(name, count))
+            total += count
+        return total
 
 
     def create_container(self, name, headers=None):
         if not self.http_conn:
             self.connect()
 
-        swift.put_container(url=self.swift_url, token=self.token,
-                            http_conn=self.http_conn, container=name,
-                            headers=headers)
+        self.call(swift.put_container, container=name, headers=headers)
         if self.debug:
             print("Container {0} created".format(name))
 
@@ -116,8 +305,7 @@ class SwiftServiceTest(object):
         if not self.http_conn:
             self.connect()
 
-        retval = swift.get_container(url=self.swift_url, token=self.token,
-                                     http_conn=self.http_conn, container=name)
+        retval = self.call(swift.get_container, container=name)
         if self.debug:
             print(retval)
         return retval
@@ -127,9 +315,7 @@ class SwiftServiceTest(object):
         if not self.http_conn:
             self.connect()
 
-        swift.post_container(url=self.swift_url, token=self.token,
-                             http_conn=self.http_conn, container=name,
-                             headers=headers)
+        self.call(swift.post_container, container=name, headers=headers)
         if self.debug:
             print("Container {0} modified".format(name))
 
@@ -138,28 +324,29 @@ class SwiftServiceTest(object):
         if not self.http_conn:
             self.connect()
 
-        swift.delete_container(url=self.swift_url, token=self.token,
-                               http_conn=self.http_conn, container=name)
+        self.call(swift.delete_container, container=name)
         if self.debug:
             print("Container {0} deleted".format(name))
 
 
+    def thread_conn(self):
+        '''Return an http connection private to the calling thread.'''
+        if getattr(self._local, 'http_conn', None) is None:
+            self._local.http_conn = swift.http_connection(self.swift_url)
+        return self._local.http_conn
+
+
     def create_object(self, cname, oname, contents, length=None):
-        swift.put_object(url=self.swift_url, token=self.token,
-                         http_conn=self.http_conn, container=cname,
-                         name=oname, contents=contents, content_length=length)
+        self.call(swift.put_object, container=cname, name=oname,
+                  contents=contents, content_length=length)
 
 
     def get_object(self, cname, oname):
-        return swift.get_object(url=self.swift_url, token=self.token,
-                                http_conn=self.http_conn, container=cname,
-                                name=oname)
+        return self.call(swift.get_object, container=cname, name=oname)
 
 
     def delete_object(self, cname, oname):
-        swift.delete_object(url=self.swift_url, token=self.token,
-                            http_conn=self.http_conn, container=cname,
-                            name=oname)
+        self.call(swift.delete_object, container=cname, name=oname)
 
 
     def test_api(self, test_name):
@@ -183,39 +370,41 @@ class SwiftServiceTest(object):
         self.connect()
 
         start = datetime.now()
-        with open('/dev/urandom') as dev_rand:
-            for i in range(count):
-                name = '{0}{1}'.format(test_name,i)
-                self.create_container(name)
+        with self.profiler.phase('stress_test.write'):
+            with open('/dev/urandom') as dev_rand:
                 for i in range(count):
-                    obj = 'obj{0}'.format(i)
-                    if self.debug:
-                        print(name,obj)
-                    contents = dev_rand.read(size)
-                    sha = hashlib.sha1(contents).hexdigest()
-                    header='X-Container-Meta-{0}'.format(obj)
-                    headers={header: sha}
-                    self.create_object(cname=name, oname=obj,
-                                       contents=contents, length=size)
-                    self.modify_container(name=name, headers=headers)
+                    name = '{0}{1}'.format(test_name,i)
+                    self.create_container(name)
+                    for i in range(count):
+                        obj = 'obj{0}'.format(i)
+                        if self.debug:
+                            print(name,obj)
+                        contents = dev_rand.read(size)
+                        sha = hashlib.sha1(contents).hexdigest()
+                        header='X-Container-Meta-{0}'.format(obj)
+                        headers={header: sha}
+                        self.create_object(cname=name, oname=obj,
+                                           contents=contents, length=size)
+                        self.modify_container(name=name, headers=headers)
         create_time = datetime.now() - start
 
         start = datetime.now()
-        for i in range(count):
-            name = '{0}{1}'.format(test_name,i)
-            cont = self.find_container(name)
+        with self.profiler.phase('stress_test.read'):
             for i in range(count):
-                obj = 'obj{0}'.format(i)
-                headers, contents = self.get_object(cname=name, oname=obj)
-                sha = hashlib.sha1(contents).hexdigest()
-                header = 'x-container-meta-{0}'.format(obj)
-                if cont[0][header] != sha:
-                    print
-                    print('Bad SHA')
-                    print
-                    raise ValueError
-                self.delete_object(cname=name, oname=obj)
-            self.delete_container(name)
+                name = '{0}{1}'.format(test_name,i)
+                cont = self.find_container(name)
+                for i in range(count):
+                    obj = 'obj{0}'.format(i)
+                    headers, contents = self.get_object(cname=name, oname=obj)
+                    sha = hashlib.sha1(contents).hexdigest()
+                    header = 'x-container-meta-{0}'.format(obj)
+                    if cont[0][header] != sha:
+                        print
+                        print('Bad SHA')
+                        print
+                        raise ValueError
+                    self.delete_object(cname=name, oname=obj)
+                self.delete_container(name)
         delete_time = datetime.now() - start
 
         name = 'stress-{0}-{1}-{2}-times.csv'.format(test_name, count, size)
@@ -226,6 +415,443 @@ class SwiftServiceTest(object):
                              delete_time.seconds / 60.0])
 
 
+    def create_large_object(self, cname, oname, segments, manifest='slo',
+                            concurrency=4, timeout=300):
+        '''
+        Upload each chunk yielded by segments in parallel into the
+        <cname>_segments container, then write an SLO (or DLO) manifest
+        named oname in cname.  Returns the time taken to write the manifest
+        and see the assembled object reported at its full size, giving up
+        after timeout seconds.
+        '''
+        seg_container = '{0}_segments'.format(cname)
+        self.create_container(seg_container)
+
+        # Segments left by a crashed run would be picked up by a DLO
+        # manifest and never let its size match.
+        for obj in self.list_objects(seg_container, prefix=oname + '/'):
+            if self.debug:
+                print("Removing stale segment {0}".format(obj['name']))
+            self.delete_object(cname=seg_container, oname=obj['name'])
+
+        def upload(args):
+            index, contents = args
+            seg_name = '{0}/{1:08d}'.format(oname, index)
+            etag = self.call(swift.put_object, container=seg_container,
+                             name=seg_name, contents=contents,
+                             content_length=len(contents))
+            if self.debug:
+                print(seg_container, seg_name, etag)
+            return {'path': '/{0}/{1}'.format(seg_container, seg_name),
+                    'etag': etag, 'size_bytes': len(contents)}
+
+        uploaded = list(bounded_imap(upload, enumerate(segments),
+                                     concurrency))
+        size = sum(seg['size_bytes'] for seg in uploaded)
+
+        start = datetime.now()
+        if manifest == 'slo':
+            self.call(swift.put_object, container=cname, name=oname,
+                      contents=json.dumps(uploaded),
+                      query_string='multipart-manifest=put')
+        elif manifest == 'dlo':
+            prefix = '{0}/{1}/'.format(seg_container, oname)
+            self.call(swift.put_object, container=cname, name=oname,
+                      contents='', content_length=0,
+                      headers={'X-Object-Manifest': prefix})
+        else:
+            raise ValueError('Unknown manifest type: {0}'.format(manifest))
+
+        # DLO listings are eventually consistent, so wait until the whole
+        # object is visible through the manifest.
+        deadline = start + timedelta(seconds=timeout)
+        backoff = 0.1
+        while True:
+            headers = self.call(swift.head_object, container=cname, name=oname)
+            length = int(headers['content-length'])
+            if length == size:
+                break
+            if datetime.now() > deadline:
+                raise Exception("Manifest {0}/{1} is {2} bytes, expected {3} "
+                                "after {4} seconds".format(cname, oname,
+                                                           length, size,
+                                                           timeout))
+            sleep(backoff)
+            backoff = min(backoff * 2, 5)
+        return datetime.now() - start
+
+
+    def get_large_object(self, cname, oname, segment_size=2**20,
+                         concurrency=4):
+        '''
+        Read oname back with concurrent ranged GETs of segment_size bytes,
+        yielding the ranges in order.
+        '''
+        headers = self.call(swift.head_object, container=cname, name=oname)
+        size = int(headers['content-length'])
+
+        def fetch(offset):
+            end = min(offset + segment_size, size) - 1
+            rng = {'Range': 'bytes={0}-{1}'.format(offset, end)}
+            return self.call(swift.get_object, container=cname, name=oname,
+                             headers=rng)[1]
+
+        return bounded_imap(fetch, range(0, size, segment_size), concurrency)
+
+
+    def delete_large_object(self, cname, oname, manifest='slo'):
+        seg_container = '{0}_segments'.format(cname)
+        if manifest == 'slo':
+            self.call(swift.delete_object, container=cname, name=oname,
+                      query_string='multipart-manifest=delete')
+        else:
+            self.delete_object(cname=cname, oname=oname)
+            prefix = '{0}/'.format(oname)
+            for obj in self.list_objects(seg_container, prefix=prefix):
+                self.delete_object(cname=seg_container, oname=obj['name'])
+        self.delete_container(seg_container)
+
+
+    def large_object_test(self, test_name, size=2**30, segment_size=2**26,
+                          concurrency=4, manifest='slo', timeout=300):
+        print("Uploading and downloading a {0} byte {1} in {2} byte segments"
+              .format(size, manifest.upper(), segment_size))
+
+        self.connect()
+        cname = '{0}_large'.format(test_name)
+        oname = 'obj'
+        self.create_container(cname)
+
+        sha = hashlib.sha1()
+        def segments(dev_rand):
+            remaining = size
+            while remaining > 0:
+                contents = dev_rand.read(min(segment_size, remaining))
+                sha.update(contents)
+                remaining -= len(contents)
+                yield contents
+
+        start = datetime.now()
+        with open('/dev/urandom', 'rb') as dev_rand:
+            manifest_time = self.create_large_object(cname, oname,
+                                                     segments(dev_rand),
+                                                     manifest=manifest,
+                                                     concurrency=concurrency,
+                                                     timeout=timeout)
+        upload_time = datetime.now() - start
+
+        start = datetime.now()
+        check = hashlib.sha1()
+        for contents in self.get_large_object(cname, oname,
+                                              segment_size=segment_size,
+                                              concurrency=concurrency):
+            check.update(contents)
+        download_time = datetime.now() - start
+
+        if check.hexdigest() != sha.hexdigest():
+            print
+            print('Bad SHA')
+            print
+            raise ValueError
+
+        self.delete_large_object(cname, oname, manifest=manifest)
+        self.delete_container(cname)
+
+        mbytes = size / float(2**20)
+        upload_rate = mbytes / upload_time.total_seconds()
+        download_rate = mbytes / download_time.total_seconds()
+        print("Upload: {0:.2f} MB/s, download: {1:.2f} MB/s, "
+              "manifest: {2}".format(upload_rate, download_rate,
+                                     manifest_time))
+
+        name = 'large-{0}-{1}-{2}-{3}-{4}-times.csv'.format(test_name, manifest,
+                                                            size, segment_size,
+                                                            concurrency)
+        with open(name, 'w+b') as csvfile:
+            output = csv.writer(csvfile)
+            output.writerow(['Upload time', 'Manifest time', 'Download time',
+                             'Upload MB/s', 'Download MB/s'])
+            output.writerow([upload_time.total_seconds(),
+                             manifest_time.total_seconds(),
+                             download_time.total_seconds(),
+                             upload_rate, download_rate])
+
+
+    def listing_test(self, test_name, concurrency=4):
+        print("Listing the account with {0} concurrent containers"
+              .format(concurrency))
+
+        self.connect()
+
+        # Page timings are written out as they arrive and summarised in a
+        # millisecond histogram, so nothing grows with the account size.
+        lock = threading.Lock()
+        stats = {'pages': 0, 'sum': 0.0, 'min': None, 'max': 0.0,
+                 'histogram': {}}
+
+        name = 'listing-{0}-{1}-times.csv'.format(test_name, concurrency)
+        with open(name, 'w+b') as csvfile:
+            output = csv.writer(csvfile)
+            output.writerow(['Container', 'Entries', 'Page time'])
+
+            def record(cname, entries, elapsed):
+                elapsed = elapsed.total_seconds()
+                with lock:
+                    output.writerow([cname, entries, elapsed])
+                    stats['pages'] += 1
+                    stats['sum'] += elapsed
+                    stats['max'] = max(stats['max'], elapsed)
+                    if stats['min'] is None or elapsed < stats['min']:
+                        stats['min'] = elapsed
+                    ms = int(elapsed * 1000)
+                    stats['histogram'][ms] = stats['histogram'].get(ms, 0) + 1
+
+            self.page_callback = record
+            try:
+                start = datetime.now()
+                total = self.get_account(deep=True, concurrency=concurrency)
+                list_time = datetime.now() - start
+            finally:
+                self.page_callback = None
+
+        p99 = 0
+        seen = 0
+        for ms in sorted(stats['histogram']):
+            seen += stats['histogram'][ms]
+            if seen >= stats['pages'] * 0.99:
+                p99 = (ms + 1) / 1000.0
+                break
+
+        print("Listed {0} objects in {1} pages in {2}".format(total,
+                                                             stats['pages'],
+                                                             list_time))
+        print("Page latency min: {0:.3f}s, mean: {1:.3f}s, p99: <{2:.3f}s, "
+              "max: {3:.3f}s".format(stats['min'],
+                                     stats['sum'] / stats['pages'],
+                                     p99, stats['max']))
+
+
+    def get_capabilities(self):
+        '''Return the cluster's /info document, or {} if unavailable.'''
+        parsed = urlparse(self.swift_url)
+        info_url = '{0}://{1}/info'.format(parsed.scheme, parsed.netloc)
+        try:
+            parsed, conn = swift.http_connection(info_url)
+            conn.request('GET', parsed.path, '', {})
+            resp = conn.getresponse()
+            body = resp.read()
+        except Exception as e:
+            if self.debug:
+                print("Could not fetch {0}: {1}".format(info_url, e))
+            return {}
+        if resp.status // 100 != 2:
+            return {}
+        return json.loads(body)
+
+
+    def bulk_delete(self, paths):
+        '''
+        Delete each of paths (of the form /container/object) in a single
+        request through the bulk-delete middleware.  Returns the number of
+        objects deleted or already gone.
+        '''
+        body = '\n'.join(quote(path) for path in paths)
+
+        def post(url, token, http_conn):
+            parsed, conn = http_conn
+            headers = {'X-Auth-Token': token,
+                       'Content-Type': 'text/plain',
+                       'Accept': 'application/json'}
+            conn.request('POST', parsed.path + '?bulk-delete', body, headers)
+            resp = conn.getresponse()
+            reply = resp.read()
+            if resp.status // 100 != 2:
+                raise swift.ClientException('Bulk delete failed',
+                                            http_status=resp.status)
+            try:
+                return json.loads(reply)
+            except ValueError:
+                raise swift.ClientException('Bulk delete returned invalid '
+                                            'JSON: {0!r}'.format(reply[:200]),
+                                            http_status=resp.status)
+
+        result = self.call(post)
+        if result.get('Errors'):
+            raise swift.ClientException('Bulk delete failed: {0}'
+                                        .format(result['Errors']))
+        return result['Number Deleted'] + result['Number Not Found']
+
+
+    def teardown(self, prefix, concurrency=8):
+        '''
+        Remove every container whose name starts with prefix, along with
+        its objects.  Objects are removed through the bulk-delete middleware
+        when the cluster advertises it, and with concurrent DELETEs
+        otherwise.
+        '''
+        self.connect()
+
+        bulk = self.get_capabilities().get('bulk_delete')
+        if bulk:
+            batch_size = bulk.get('max_deletes_per_request', 10000)
+            print("Tearing down '{0}*' with bulk delete".format(prefix))
+        else:
+            print("Tearing down '{0}*' with {1} concurrent deletes"
+                  .format(prefix, concurrency))
+
+        def delete(oname):
+            # Listings after a crash may name objects that are already gone.
+            try:
+                self.call(swift.delete_object, container=cname, name=oname)
+            except swift.ClientException as e:
+                if e.http_status != 404:
+                    raise
+            return 1
+
+        start = datetime.now()
+        count = 0
+        containers = [utf8(c['name'])
+                      for c in self.list_containers(prefix=prefix)]
+        for cname in containers:
+            names = (utf8(obj['name']) for obj in self.list_objects(cname))
+            if bulk:
+                paths = ('/{0}/{1}'.format(cname, name) for name in names)
+                count += sum(bounded_imap(self.bulk_delete,
+                                          batches(paths, batch_size),
+                                          concurrency))
+            else:
+                count += sum(bounded_imap(delete, names, concurrency))
+
+            # Container listings may briefly lag the deletes.
+            backoff = 1
+            while True:
+                try:
+                    self.delete_container(cname)
+                    break
+                except swift.ClientException as e:
+                    if e.http_status != 409 or backoff > 16:
+                        raise
+                    sleep(backoff)
+                    backoff *= 2
+        delete_time = datetime.now() - start
+
+        rate = count / max(delete_time.total_seconds(), 0.001)
+        print("Deleted {0} objects in {1} containers in {2} ({3:.1f} "
+              "objects/s)".format(count, len(containers), delete_time, rate))
+
+        name = 'teardown-{0}-times.csv'.format(prefix)
+        with open(name, 'w+b') as csvfile:
+            output = csv.writer(csvfile)
+            output.writerow(['Containers', 'Objects', 'Delete time',
+                             'Objects/s', 'Bulk delete'])
+            output.writerow([len(containers), count,
+                             delete_time.total_seconds(), rate, bool(bulk)])
+
+
+    def soak_test(self, test_name, duration, size=2**20, concurrency=1,
+                  interval=60):
+        '''
+        PUT, GET and DELETE objects from concurrency threads for duration
+        seconds.  Every interval seconds the throughput and latency
+        percentiles of each operation are appended to a CSV file, and the
+        samples discarded, so memory use does not grow with the run length.
+        '''
+        print("Soaking for {0} seconds with {1} threads".format(duration,
+                                                               concurrency))
+        self.connect()
+        cname = '{0}_soak'.format(test_name)
+        self.create_container(cname)
+
+        with open('/dev/urandom', 'rb') as dev_rand:
+            contents = dev_rand.read(size)
+        etag = hashlib.md5(contents).hexdigest()
+
+        lock = threading.Lock()
+        stop = threading.Event()
+        window = {'samples': {}, 'errors': {}}
+
+        def timed(op, func, *args, **kwargs):
+            start = datetime.now()
+            try:
+                retval = func(*args, **kwargs)
+            except Exception as e:
+                if self.debug:
+                    print("{0} failed: {1}".format(op, e))
+                with lock:
+                    window['errors'][op] = window['errors'].get(op, 0) + 1
+                return None
+            elapsed = (datetime.now() - start).total_seconds()
+            with lock:
+                window['samples'].setdefault(op, []).append(elapsed)
+            return retval
+
+        def worker(index):
+            count = 0
+            while not stop.is_set():
+                oname = 'obj{0}-{1}'.format(index, count)
+                timed('PUT', self.create_object, cname=cname, oname=oname,
+                      contents=contents, length=size)
+                obj = timed('GET', self.get_object, cname=cname, oname=oname)
+                if obj is not None and obj[0]['etag'] != etag:
+                    with lock:
+                        window['errors']['GET'] = \
+                                window['errors'].get('GET', 0) + 1
+                timed('DELETE', self.delete_object, cname=cname, oname=oname)
+                count += 1
+
+        name = 'soak-{0}-{1}-{2}-{3}.csv'.format(test_name, duration, size,
+                                                concurrency)
+        with open(name, 'w+b') as csvfile:
+            output = csv.writer(csvfile)
+            output.writerow(['Time', 'Elapsed', 'Operation', 'Count',
+                             'Ops/s', 'p50', 'p90', 'p99', 'Max', 'Errors',
+                             'Reauths', 'Reconnects', 'Server errors'])
+            csvfile.flush()
+
+            threads = [threading.Thread(target=worker, args=(i,))
+                       for i in range(concurrency)]
+            start = datetime.now()
+            deadline = start + timedelta(seconds=duration)
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+
+            last = start
+            while last < deadline:
+                until = min(last + timedelta(seconds=interval), deadline)
+                sleep(max((until - datetime.now()).total_seconds(), 0))
+                if until == deadline:
+                    stop.set()
+                    for thread in threads:
+                        thread.join()
+
+                now = datetime.now()
+                with lock:
+                    samples, errors = window['samples'], window['errors']
+                    window['samples'], window['errors'] = {}, {}
+                span = (now - last).total_seconds()
+                for op in ('PUT', 'GET', 'DELETE'):
+                    times = sorted(samples.get(op, []))
+                    output.writerow([now.isoformat(),
+                                     (now - start).total_seconds(), op,
+                                     len(times), len(times) / span,
+                                     percentile(times, 0.5),
+                                     percentile(times, 0.9),
+                                     percentile(times, 0.99),
+                                     times[-1] if times else 0,
+                                     errors.get(op, 0), self.reauths,
+                                     self.reconnects, self.server_errors])
+                csvfile.flush()
+                if self.debug:
+                    print("{0}: {1} ops".format(now, sum(len(t) for t in
+                                                         samples.values())))
+                last = now
+
+        for obj in self.list_objects(cname):
+            self.delete_object(cname=cname, oname=obj['name'])
+        self.delete_container(cname)
+
+
     def test_suite(self, test_name):
         self.test_api(test_name)
         self.stress_test(test_name)
@@ -240,10 +866,45 @@ if __name__ == '__main__':
                   default=False, help="Turn on stress testing.")
     op.add_option('-n', '--name', dest='name', default="swift_test",
                   help="Name to prepend to containers")
+    op.add_option('-t', '--teardown', action='store_true', dest='teardown',
+                  default=False, help="Delete all containers starting with "
+                  "--name, e.g. after a failed run.")
     op.add_option('-c', '--stress-count', dest='count', default=10, type=int,
                   help="Number of containers and objects-per-container.")
     op.add_option('--stress-size', dest='size', default=2**20, type=int,
                   help="Size (in bytes) of each object created")
+    op.add_option('-l', '--list', action='store_true', dest='list',
+                  default=False, help="Turn on full account listing.")
+    op.add_option('-L', '--large', action='store_true', dest='large',
+                  default=False, help="Turn on large object testing.")
+    op.add_option('--large-size', dest='large_size', default=2**30, type=int,
+                  help="Size (in bytes) of the large object")
+    op.add_option('--segment-size', dest='segment_size', default=2**26,
+                  type=int, help="Size (in bytes) of each large object "
+                  "segment and ranged GET")
+    op.add_option('--concurrency', dest='concurrency', default=4, type=int,
+                  help="Number of parallel transfers, container listings, "
+                  "deletes or soak threads.")
+    op.add_option('--soak', dest='soak', default=0, type=int,
+                  help="Run a soak test for this many seconds.")
+    op.add_option('--soak-interval', dest='soak_interval', default=60,
+                  type=int, help="Seconds between soak test snapshots.")
+    op.add_option('--retries', dest='retries', default=3, type=int,
+                  help="Times to retry a request after reauthenticating or "
+                  "reconnecting.")
+    op.add_option('-p', '--profile', action='store_true', dest='profile',
+                  default=False, help="Profile each test phase, writing "
+                  "dumps to profile-<name>.")
+    op.add_option('--profile-timings', action='store_true',
+                  dest='profile_timings', default=False, help="Record only "
+                  "the per-phase CPU/wait split, without the overhead of "
+                  "cProfile and tracemalloc.")
+    op.add_option('--timeout', dest='timeout', default=300, type=int,
+                  help="Seconds to wait for a large object manifest to "
+                  "report its full size.")
+    op.add_option('--dlo', action='store_const', dest='manifest',
+                  const='dlo', default='slo',
+                  help="Use a dynamic instead of a static large object.")
     options, args = op.parse_args()
 
     username = os.environ['OS_USERNAME']
@@ -253,15 +914,52 @@ if __name__ == '__main__':
     swift_url = os.environ['OS_OBJECT_URL']
 
     sst = SwiftServiceTest(username=username, password=password, tenant=tenant,
-                           auth_url=auth_url, swift_url=swift_url, debug=True)
+                           auth_url=auth_url, swift_url=swift_url, debug=True,
+                           retries=options.retries,
+                           profiler=PhaseProfiler(
+                               'profile-' + options.name,
+                               enabled=(options.profile or
+                                        options.profile_timings),
+                               instrument=options.profile))
+    if options.profile or options.profile_timings:
+        logging.basicConfig(format='%(levelname)s\t%(name)s\t%(message)s')
     sst.connect()
 
     if options.api:
-        sst.test_api(test_name=options.name)
+        with sst.profiler.phase('test_api'):
+            sst.test_api(test_name=options.name)
 
     if options.stress:
         sst.stress_test(test_name=options.name, count=options.count,
                      size=options.size)
 
-    if not (options.api or options.stress):
+    if options.large:
+        with sst.profiler.phase('large_object_test'):
+            sst.large_object_test(test_name=options.name,
+                                  size=options.large_size,
+                                  segment_size=options.segment_size,
+                                  concurrency=options.concurrency,
+                                  manifest=options.manifest,
+                                  timeout=options.timeout)
+
+    if options.soak:
+        with sst.profiler.phase('soak_test'):
+            sst.soak_test(test_name=options.name, duration=options.soak,
+                          size=options.size, concurrency=options.concurrency,
+                          interval=options.soak_interval)
+
+    if options.list:
+        with sst.profiler.phase('listing_test'):
+            sst.listing_test(test_name=options.name,
+                             concurrency=options.concurrency)
+
+    if options.teardown:
+        with sst.profiler.phase('teardown'):
+            sst.teardown(prefix=options.name,
+                         concurrency=options.concurrency)
+
+    sst.profiler.summary()
+
+    if not (options.api or options.stress or options.large or options.list
+            or options.soak or options.teardown):
         print("No tests set to be run")